@@ -4,9 +4,34 @@ This class handles basic game logic for a connect four game of variable size, in
     unmaking moves
     getting legal moves
 """
+from bisect import insort
+from functools import lru_cache
+
+# For each bit index of a board of this size, lists the bitmask of every four-in-a-row that contains that cell
+# A win can only be made by the piece just placed, so make_move only needs to check the masks of that one cell
+# Cached, since it only depends on the board size and every copy of a board would otherwise rebuild it
+@lru_cache(maxsize=None)
+def _winmasks_by_cell(nrows: int, ncols: int) -> tuple[tuple[int, ...], ...]:
+    winmasks = [[] for _ in range(ncols * (nrows + 1))] # Sentinel cells are never played, so their lists stay empty
+    for col in range(ncols):
+        for row in range(nrows):
+            for dcol, drow in ((0, 1), (1, 0), (1, 1), (1, -1)): # Each line is found once, from its first cell
+                if 0 <= col + 3 * dcol < ncols and 0 <= row + 3 * drow < nrows:
+                    cells = [(col + i * dcol) * (nrows + 1) + row + i * drow for i in range(4)]
+                    mask = sum(1 << cell for cell in cells)
+                    for cell in cells:
+                        winmasks[cell].append(mask)
+    return tuple(tuple(masks) for masks in winmasks)
+
+# Bitboards of the bottom cell of every column, and of every cell on the board (leaving out the sentinel cells)
+@lru_cache(maxsize=None)
+def _board_masks(nrows: int, ncols: int) -> tuple[int, int]:
+    bottom = sum(1 << (col * (nrows + 1)) for col in range(ncols))
+    return bottom, bottom * ((1 << nrows) - 1)
+
 class ConnectFour:
 
-    def __init__(self, nrows: int=6, ncols: int=7, moves: list=[]) -> None:
+    def __init__(self, nrows: int=6, ncols: int=7, moves: list=None) -> None:
         if nrows < 4 and ncols < 4 or nrows < 1 or ncols < 2:
             raise ValueError("This board size is too small for Connect Four to be played at all. ")
         self.nrows = nrows
@@ -14,8 +39,14 @@ class ConnectFour:
         self.moves = []
         self.player = 1
         self.winner = None
-        self.board = [[0 for _ in range(ncols)] for _ in range(nrows)] 
-        for index, move in enumerate(moves):
+        self.bb = [0, 0] # One bitboard per player: index 0 holds player 1's pieces, index 1 holds player -1's
+        self.heights = [col * (nrows + 1) for col in range(ncols)] # Bit index of the next empty cell in each column
+        # Bit col*(nrows+1) + row is set if the cell in that column, counting rows from the bottom, holds a piece
+        # The extra (sentinel) bit at the top of each column is always empty, so shifts never wrap between columns
+        self._winmasks = _winmasks_by_cell(nrows, ncols)
+        self._bottom, self._full = _board_masks(nrows, ncols)
+        self._legal = list(range(ncols)) # Columns that aren't full, in order; updated by make_move and unmake_move
+        for index, move in enumerate(moves or []):
             if self.make_move(move) == False:
                 raise ValueError(f"The inputted sequence of moves is invalid. Encountered error at move {index} ({move}). ")
     
@@ -23,30 +54,76 @@ class ConnectFour:
     def reset(self) -> None:
         self.moves = []
         self.player = 1
-        self.board = [[0 for _ in range(self.ncols)] for _ in range(self.nrows)]
+        self.bb = [0, 0]
+        self.heights = [col * (self.nrows + 1) for col in range(self.ncols)]
+        self._legal = list(range(self.ncols))
         self.winner = None
+
+    # Builds the board as a list of rows (top row first) containing 1, -1 or 0 for empty; used for display
+    @property
+    def board(self) -> list[list[int]]:
+        board = [[0 for _ in range(self.ncols)] for _ in range(self.nrows)]
+        for col in range(self.ncols):
+            for row in range(self.nrows):
+                bit = 1 << (col * (self.nrows + 1) + row)
+                if self.bb[0] & bit:
+                    board[self.nrows-1-row][col] = 1
+                elif self.bb[1] & bit:
+                    board[self.nrows-1-row][col] = -1
+        return board
     
     # Gets a list of all legal moves, starting from 0 for the leftmost column; no moves are legal after game is over
     def get_legal_moves(self) -> list[int]:
         if self.winner is not None:
             return []
-        return [col for col, piece in enumerate(self.board[0]) if piece == 0]
+        return self._legal[:] # A copy, so callers can't change the board's own list
+
+    # Same as get_legal_moves, but returns the board's own list, which make_move and unmake_move keep updating
+    # For rollouts; it must not be modified, and it doesn't check whether the game is over
+    def _legal_moves_fast(self) -> list[int]:
+        return self._legal
     
+    # Returns a bitboard of the cells that can be played next: the lowest empty cell of every column that isn't full
+    def _playable_cells(self) -> int:
+        return (self.bb[0] | self.bb[1]) + self._bottom & self._full # Adding a column's bottom bit carries up to its first empty cell
+
+    # Returns a bitboard of the cells that would complete a four-in-a-row for bb, whether or not they are empty or playable
+    def _winning_cells(self, bb: int) -> int:
+        h = self.nrows + 1
+        cells = (bb << 1) & (bb << 2) & (bb << 3) # Vertical: three pieces below
+        for d in (h, h - 1, h + 1): # Horizontal and the two diagonals: three of the four cells around the gap
+            pair = (bb << d) & (bb << 2 * d)
+            cells |= pair & (bb << 3 * d) | pair & (bb >> d)
+            pair = (bb >> d) & (bb >> 2 * d)
+            cells |= pair & (bb << d) | pair & (bb >> 3 * d)
+        return cells
+
     # Finds and returns the [row, col] position of the last piece placed
     def get_most_recent_move(self) -> list[int]:
         if not self.moves:
             return None
-        return [min(row for row in range(self.nrows) if self.board[row][self.moves[-1]] != 0), self.moves[-1]] 
-        # takes the column (self.moves[-1]) and the geographically highest (lowest-number row) piece which is not 0 in that column
+        col = self.moves[-1]
+        return [self.nrows - (self.heights[col] - col * (self.nrows + 1)), col] # The column's height gives the row of its top piece
 
     # Updates the board, checks for a winner, etc. Returns whether the move was valid and successfully made
     def make_move(self, move: int) -> bool:
-        if move not in self.get_legal_moves():
+        if self.winner is not None or move not in self._legal:
             return False 
-        height = self.moves.count(move) # Counts how many times a particular column has been played before to see how high to put the piece
-        self.board[self.nrows-1-height][move] = self.player
+        index = self.player == -1
+        cell = self.heights[move]
+        bb = self.bb[index] ^ (1 << cell) # Place the piece in the lowest empty cell of the column
+        self.bb[index] = bb
+        self.heights[move] += 1
+        if cell - move * (self.nrows + 1) == self.nrows - 1: # The column is now full
+            self._legal.remove(move)
         self.moves.append(move)
-        self._check_winner()
+        for mask in self._winmasks[cell]: # Only the player who just moved can have won, with the piece just placed
+            if bb & mask == mask:
+                self.winner = self.player
+                break
+        else:
+            if len(self.moves) == self.nrows * self.ncols: # In case of draw (board is full and there is no winner)
+                self.winner = 0
         self.player *= -1
         return True 
     
@@ -54,47 +131,33 @@ class ConnectFour:
     def unmake_move(self) -> bool:
         if not self.moves:
             return False
-        most_recent_move = self.get_most_recent_move()
+        move = self.moves.pop()
         self.player *= -1
-        self.board[most_recent_move[0]][most_recent_move[1]] = 0
-        self.moves.pop()
+        if self.heights[move] - move * (self.nrows + 1) == self.nrows: # The column was full
+            insort(self._legal, move)
+        self.heights[move] -= 1
+        self.bb[self.player == -1] ^= 1 << self.heights[move] # Remove the top piece of the column
         self.winner = None
         return True
     
-    # Checks if the game is won with the most recent piece. Used inside of self.make_move(). Returns whether the game is over yet
-    def _check_winner(self) -> bool: 
-        if len(self.moves) < 7:
-            return False # There can't be a winner yet
-        
-        # Returns whether a given line contains a four-in-a-row
-        def _check_line(line: list[int]) -> bool:
-            for i in range(len(line)-3):
-                if abs(sum(line[i:i+4])) == 4:
-                    return True
-            return False
-        
-        mrm = self.get_most_recent_move()
-        left_dis = min(3, mrm[1])               # pieces further away from the most recent move than this aren't 
-        right_dis = min(3, self.ncols-1-mrm[1]) # necessary to check for a four-in-a-row as they are too far away 
-        up_dis = min(3, mrm[0])                 # or not within the board 
-        down_dis = min(3, self.nrows-1-mrm[0])
+    # Copies the state directly, rather than replaying (and re-checking) every move as the constructor would
+    @classmethod
+    def _fast_clone(cls, src): # -> ConnectFour
+        self = cls.__new__(cls)
+        self.nrows = src.nrows
+        self.ncols = src.ncols
+        self.moves = src.moves[:]
+        self.player = src.player
+        self.winner = src.winner
+        self.bb = src.bb[:]
+        self.heights = src.heights[:]
+        self._winmasks = src._winmasks # Never modified, so can be shared
+        self._bottom, self._full = src._bottom, src._full
+        self._legal = src._legal[:]
+        return self
 
-        horizontal_line = [self.board[mrm[0]][i] for i in range(mrm[1]-left_dis, mrm[1]+right_dis+1)]   # Returns the horizontal line containing the most recent move
-        vertical_line = [self.board[i][mrm[1]] for i in range(mrm[0]-up_dis, mrm[0]+down_dis+1)]        # that does need to be checked for a four-in-a-row
-        positive_line = [self.board[mrm[0]-i][mrm[1]+i] for i in range(-min(down_dis, left_dis), min(up_dis, right_dis) + 1)]   # Contains every element from current-left_dis
-        negative_line = [self.board[mrm[0]+i][mrm[1]+i] for i in range(-min(up_dis, left_dis), min(down_dis, right_dis) + 1)]   # to current+right_dis, for instance
-                                                                                                        # For diagonals, chooses the smaller distance to not go out of bounds
-
-        if _check_line(horizontal_line) or _check_line(vertical_line) or _check_line(positive_line) or _check_line(negative_line):
-            self.winner = self.player
-            return True 
-        if len(self.moves) == self.nrows * self.ncols: # In case of draw (board is full and there is no winner)
-            self.winner = 0
-            return True 
-        return False
-    
     def copy(self):
-        return ConnectFour(ncols=self.ncols, nrows=self.nrows, moves=self.moves)
+        return ConnectFour._fast_clone(self)
 
     def __str__(self) -> str: # So you can do print(object) and get a reasonable format
         board_rep = "\n"
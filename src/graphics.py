@@ -6,6 +6,8 @@ The other arguments are passed on to montecarlo.find_best_move()
 
 from connectfour import ConnectFour as CF
 from montecarlo import find_best_move
+import queue
+import threading
 import time
 import pygame
 
@@ -30,17 +32,29 @@ def run_game(game: CF, human_first: bool, thinking_time: float=1.6, sims: int=64
     screen = pygame.display.set_mode((SQUARE_WIDTH * (NCOLS), SQUARE_HEIGHT * (NROWS + 2)))
     pygame.display.set_caption("Connect Four")
 
+    background = pygame.Surface(screen.get_size()) # The empty board never changes, so it is only drawn once
+    background.fill(BLACK)
+    pygame.draw.rect(background, BLUE, (0, SQUARE_HEIGHT, SQUARE_WIDTH * NCOLS, SQUARE_HEIGHT * NROWS)) # Main blue board
+    for y in range(NROWS):
+        for x in range(NCOLS):
+            pygame.draw.circle(background, GRAY, ((.5 + x) * SQUARE_WIDTH, (1.5 + y) * SQUARE_HEIGHT), PIECE_SIZE) # Empty slots
+
+    font = pygame.font.SysFont('Arial', min(SQUARE_HEIGHT // 2, SQUARE_WIDTH * NCOLS // 18))
+    thinking_text = font.render('Computer is thinking... ', True, GREEN)
+    game_over_text = font.render('Game Over! Press enter to play again. ', True, GREEN)
+
+    search = None # Thread running find_best_move while the computer is thinking
+    results = queue.Queue() # Where the search puts the move it chose
+    stop_search = threading.Event() # Set to end the search early
+
     running = True
     while running:
-        screen.fill(BLACK)
-        pygame.draw.rect(screen, BLUE, (0, SQUARE_HEIGHT, SQUARE_WIDTH * NCOLS, SQUARE_HEIGHT * NROWS)) # Main blue board
+        screen.blit(background, (0, 0))
 
         for y, row in enumerate(game.board): # Draw all of the pieces
             for x, piece in enumerate(row):
                 if piece == 1:
                     pygame.draw.circle(screen, RED, ((.5 + x) * SQUARE_WIDTH, (1.5 + y) * SQUARE_HEIGHT), PIECE_SIZE)
-                if piece == 0:
-                    pygame.draw.circle(screen, GRAY, ((.5 + x) * SQUARE_WIDTH, (1.5 + y) * SQUARE_HEIGHT), PIECE_SIZE)
                 if piece == -1:
                     pygame.draw.circle(screen, YELLOW, ((.5 + x) * SQUARE_WIDTH, (1.5 + y) * SQUARE_HEIGHT), PIECE_SIZE)
         
@@ -56,15 +70,20 @@ def run_game(game: CF, human_first: bool, thinking_time: float=1.6, sims: int=64
                 if game.player == -1:
                     pygame.draw.circle(screen, YELLOW, (x, 0.5 * SQUARE_HEIGHT), PIECE_SIZE) # to see where it would go
             else:
-                font = pygame.font.SysFont('Arial', min(SQUARE_HEIGHT // 2, SQUARE_WIDTH * NCOLS // 18)) # Game over text
-                text = font.render('Computer is thinking... ', True, GREEN)
-                screen.blit(text, (0, SQUARE_HEIGHT // 6))
-                pygame.display.flip() 
-                game.make_move(find_best_move(env=game, thinking_time=thinking_time, sims=sims, exploration=exploration))
+                screen.blit(thinking_text, (0, SQUARE_HEIGHT // 6))
+                if search is None: # Start thinking in the background, so the window keeps responding
+                    env = game.copy() # The search gets its own board, since the game's board is still being drawn
+                    search = threading.Thread(target=lambda: results.put(find_best_move(env=env, thinking_time=thinking_time, sims=sims,
+                                                                                        exploration=exploration, stop_event=stop_search)), daemon=True)
+                    search.start()
+                else:
+                    try:
+                        game.make_move(results.get_nowait())
+                        search = None
+                    except queue.Empty: # Still thinking
+                        pass
         else:
-            font = pygame.font.SysFont('Arial', min(SQUARE_HEIGHT // 2, SQUARE_WIDTH * NCOLS // 18)) # Game over text
-            text = font.render('Game Over! Press enter to play again. ', True, GREEN)
-            screen.blit(text, (0, SQUARE_HEIGHT // 6))
+            screen.blit(game_over_text, (0, SQUARE_HEIGHT // 6))
 
         time.sleep(1 / FPS) 
 
@@ -82,8 +101,11 @@ def run_game(game: CF, human_first: bool, thinking_time: float=1.6, sims: int=64
                 if event.key == pygame.K_RETURN: # Restart the game (after it is over)
                     if game.winner is not None:
                         game.reset()
-                if event.key == pygame.K_LEFT:
+                if event.key == pygame.K_LEFT and search is None: # Go back a move (not while the computer is thinking)
                     game.unmake_move()
                     game.unmake_move()
         
+    if search is not None: # Stop the computer if it is in the middle of thinking
+        stop_search.set()
+        search.join()
     pygame.quit()
@@ -15,17 +15,44 @@ to get which move the algorithm believes has the highest win rate
 from connectfour import ConnectFour as CF
 import random
 import time
-from math import log, sqrt
+from array import array
+from collections import deque
+from math import inf, log, sqrt
+try: # Compiled rollouts are optional, but far faster: Numba if it is installed, otherwise the C version if it has been built
+    from rollout_numba import fits, rollout_position, expand_position
+except ImportError:
+    try:
+        from rollout_c import fits, rollout_position, expand_position
+    except OSError:
+        rollout_position = expand_position = None
+
+# How strongly the AMAF statistics are mixed into the UCB formula: a move's own win rate and its AMAF win rate
+# are weighted equally once it has this many visits, after which the AMAF part fades away
+RAVE_K = 250
+
+_rng = random.Random() # Rollouts bind its randrange directly, rather than calling random.choice
+_randrange = _rng.randrange
 
 class Node:
 
     # Creates a new node. 
-    def __init__(self, env: CF, exploration: float, sims: int=100, parent=None) -> None:
+    # tt is the transposition table shared by the whole tree, mapping (bb0, bb1, player) to the node for that position
+    # amaf is the (amaf_wins, amaf_visits) shared by the whole tree (see below)
+    # tallies can be given as [positive_wins, negative_wins] if the node has already been rolled out; the caller
+    # (expand) is then responsible for passing the result back up the path to the root
+    def __init__(self, env: CF, exploration: float, sims: int=100, tt: dict=None, amaf: tuple=None, tallies: list[int]=None) -> None:
         self.children = []
+        # Statistics of the moves to the children, stored in parallel arrays (child i is self.children[i]) so that
+        # choosing a child only needs to read these arrays. Kept up to date by backpass
+        # A child can be reached from several positions, so these count only the visits made through this node
+        self.child_wins = array("d")
+        self.child_visits = array("d")
+        self.child_inv_sqrt_visits = array("d") # 1 / sqrt(visits), for the UCB formula
+        self.child_betas = array("d") # How much of the AMAF win rate to use, which depends only on the visits
+        self.child_moves = array("b")
         self.terminal = env.winner is not None
-        self.parent = parent
         self.leaf = True # Whether this node is a leaf (doesn't have children)
-        self.visits = 0 # How many rollouts
+        self.visits = 0 # How many rollouts, through any path
         self.wins = 0 # Rollout outcomes
         self.env = env # Keeps the game state of the node
         self.exploration = exploration # Rate of exploration used in UCB equation: should be around 0.5-2
@@ -34,82 +61,229 @@ class Node:
         if self.env.moves:
             self.move = self.env.moves[-1]
         else:
-            self.move = None # What move separates this node from its parent
-        wins, losses = self.rollout(self.env, self.sims) # Initial rollout
-        self.backpass(self.sims, wins, losses)
-    
-    # Upper confidence bound formula--will never be applied to a node without a parent
-    def ucb(self) -> float:
-        return (self.wins / self.visits) + self.exploration * sqrt(log(self.parent.visits) / self.visits)
-    
-    # Select a child to go to using the UCB formula
-    def favorite_child(self): # -> Node
-        if self.terminal == False:
-            return max(self.children, key=lambda child: child.ucb())
+            self.move = None # What move first led to this node
+        self.tt = {} if tt is None else tt
+        self.tt[self.key(env)] = self
+        # All-moves-as-first (AMAF) statistics, shared by the whole tree: amaf_visits[i][col] counts the rollouts in which
+        # player i (0 for player 1, 1 for player -1) played in col at some point, and amaf_wins[i][col] how many of those
+        # they won. They give every move an estimate of its win rate from far more games than the move's own statistics
+        if amaf is None:
+            amaf = ([[0.0] * env.ncols for _ in range(2)], [[0.0] * env.ncols for _ in range(2)])
+        self.amaf_wins, self.amaf_visits = amaf
+        if tallies is None:
+            wins, losses = self.rollout(self.env, self.sims, amaf) # Initial rollout
+            self.backpass([self], [], self.sims, wins, losses)
+        else:
+            wins, losses = tallies
+            self.visits = self.sims
+            self.wins = wins if self.turn == -1 else losses
+
+    # Identifies a position in the transposition table
+    @staticmethod
+    def key(env: CF) -> tuple[int, int, int]:
+        return (env.bb[0], env.bb[1], env.player)
     
     # Heart of Monte Carlo: play many games with randomly chosen moves
     # and see who wins the most in order to evaluate a position. 
+    # Each move wins immediately if it can, or else blocks the opponent from winning immediately, and is only random otherwise
+    # If amaf (amaf_wins, amaf_visits) is given, the games are also counted in it
     @staticmethod
-    def rollout(env: CF, sims: int) -> int:
+    def rollout(env: CF, sims: int, amaf: tuple=None) -> list[int]:
+        if env.winner is not None: # Every game from a finished position has the same result
+            return [sims * (env.winner == 1), sims * (env.winner == -1)]
+        if rollout_position is not None and fits(env.nrows, env.ncols):
+            positive_wins, negative_wins, amaf_wins, amaf_visits = rollout_position(env, sims)
+            if amaf is not None:
+                _add_amaf(amaf, amaf_wins, amaf_visits)
+            return [positive_wins, negative_wins]
         positive_wins = 0
         negative_wins = 0
-        for _ in range(sims):
-            new_env = env.copy()
-            while new_env.winner is None:
-                new_env.make_move(random.choice(new_env.get_legal_moves())) # Random simulation
-            if new_env.winner == 1:
+        bb0, bb1, heights, legal, player, nmoves = env.bb[0], env.bb[1], env.heights[:], env._legal[:], env.player, len(env.moves)
+        legal_moves = env._legal_moves_fast() # Stays up to date as moves are made, so is only fetched once
+        randrange = _randrange
+        column_height = env.nrows + 1
+        for _ in range(sims): # Every game is played on env itself, which is then put back how it was
+            while env.winner is None:
+                playable = env._playable_cells()
+                cells = env._winning_cells(env.bb[env.player == -1]) & playable # Win if possible
+                if not cells:
+                    cells = env._winning_cells(env.bb[env.player == 1]) & playable # Otherwise block the opponent
+                if cells:
+                    env.make_move(((cells & -cells).bit_length() - 1) // column_height) # Column of the lowest such cell
+                else:
+                    env.make_move(legal_moves[randrange(len(legal_moves))]) # Random simulation
+            if env.winner == 1:
                 positive_wins += 1
-            if new_env.winner == -1:
+            if env.winner == -1:
                 negative_wins += 1
+            if amaf is not None:
+                _record_amaf(amaf, env.moves[nmoves:], player, env.winner)
+            env.bb[0], env.bb[1], env.player, env.winner = bb0, bb1, player, None
+            env.heights[:] = heights
+            env._legal[:] = legal
+            del env.moves[nmoves:]
         return [positive_wins, negative_wins]
     
-    # Take rollout information from a leaf node and recurse back down the tree
-    def backpass(self, runs: int, wins: int, losses: int) -> None:
-        self.visits += runs
-        if self.turn == -1:
-            self.wins += wins
-        else:
-            self.wins += losses
-        if self.parent is not None: # Stop at the root node
-            self.parent.backpass(runs, wins, losses) # Recurse through parents
+    # Take rollout information from a leaf node and pass it back down the path that led to it, up to the root
+    # indices[i] is the position of path[i+1] among path[i]'s children
+    @staticmethod
+    def backpass(path: list, indices: list[int], runs: int, wins: int, losses: int) -> None:
+        for depth, node in enumerate(path):
+            node.visits += runs
+            node.wins += wins if node.turn == -1 else losses
+            if depth < len(indices): # Also update the move taken from this node, from the child's point of view
+                index = indices[depth]
+                node.child_visits[index] += runs
+                node.child_wins[index] += losses if node.turn == -1 else wins
+                node.child_inv_sqrt_visits[index] = 1 / sqrt(node.child_visits[index])
+                node.child_betas[index] = sqrt(RAVE_K / (3 * node.child_visits[index] + RAVE_K))
     
     # Take a leaf node, create and rollout all of its children. 
-    def expand(self) -> None:
-        for move in self.env.get_legal_moves():
-            child = self.env.copy()
-            child.make_move(move)
-            self.children.append(Node(child, self.exploration, self.sims, self)) # Create children
+    # Children whose position is already in the transposition table reuse that node, and aren't rolled out again
+    # path and indices lead from the root to this node (as returned by _descend); by default this node is the root
+    def expand(self, path: list=None, indices: list[int]=None) -> None:
+        if path is None:
+            path, indices = [self], []
+        moves = self.env.get_legal_moves()
+        self.child_wins = array("d", [0.0]) * len(moves) # Filled in as each child is created
+        self.child_visits = array("d", [0.0]) * len(moves)
+        self.child_inv_sqrt_visits = array("d", [0.0]) * len(moves)
+        self.child_betas = array("d", [0.0]) * len(moves)
+        self.child_moves = array("b", moves)
+        self.children = [None] * len(moves)
+        new = [] # (index, env) of the children that aren't in the table yet
+        for index, move in enumerate(moves):
+            env = self.env.copy()
+            env.make_move(move)
+            child = self.tt.get(self.key(env)) # Every move adds a piece, so this can never be a node on the path (no cycles)
+            if child is None:
+                new.append((index, env))
+            else: # Start the move's statistics from everything already known about the position
+                self._add_child(index, child)
+        if expand_position is not None and fits(self.env.nrows, self.env.ncols): # Roll out every new child in one call
+            positive_wins, negative_wins, amaf_wins, amaf_visits = expand_position(self.env, [moves[index] for index, _ in new], self.sims)
+            tallies = zip(positive_wins, negative_wins)
+            _add_amaf((self.amaf_wins, self.amaf_visits), amaf_wins, amaf_visits)
+        else:
+            tallies = [self.rollout(env, self.sims, (self.amaf_wins, self.amaf_visits)) for _, env in new]
+        total_wins = 0
+        total_losses = 0
+        for (index, env), (wins, losses) in zip(new, tallies):
+            self._add_child(index, Node(env, self.exploration, self.sims, self.tt, (self.amaf_wins, self.amaf_visits), [wins, losses])) # Create children
+            total_wins += wins
+            total_losses += losses
+        if new:
+            self.backpass(path, indices, self.sims * len(new), total_wins, total_losses) # One backpass for all of the new children
         self.leaf = False
     
-    # If it is a not a leaf node, it chooses its favorite child repeatedly (using UCB) until it reaches a leaf node
+    # Puts a child into position index among the children, starting the move's statistics from the child's
+    def _add_child(self, index: int, child) -> None:
+        self.children[index] = child
+        self.child_visits[index] = child.visits
+        self.child_wins[index] = child.wins
+        self.child_inv_sqrt_visits[index] = 1 / sqrt(child.visits)
+        self.child_betas[index] = sqrt(RAVE_K / (3 * child.visits + RAVE_K))
+    
+    # Starting from this node, repeatedly chooses the child with the highest upper confidence bound (UCB1)
+    # until it reaches a leaf node. Returns the path of nodes taken, and the index of each child chosen along it
+    # The win rate in the formula is blended with the move's AMAF win rate (RAVE), weighted by child_betas
+    def _descend(self) -> tuple[list, list[int]]:
+        node = self
+        path = [node]
+        indices = []
+        while not node.leaf:
+            # exploration * sqrt(log(N) / n) is split into a part shared by every child, computed once here,
+            # and the 1 / sqrt(n) part which is cached for each child
+            exploration = node.exploration * sqrt(log(node.visits))
+            wins = node.child_wins
+            visits = node.child_visits
+            inv_sqrt_visits = node.child_inv_sqrt_visits
+            betas = node.child_betas
+            moves = node.child_moves
+            amaf_wins = node.amaf_wins[node.turn == -1] # The moves are all made by the player to move here
+            amaf_visits = node.amaf_visits[node.turn == -1]
+            best = 0
+            best_ucb = -inf
+            for index in range(len(visits)):
+                win_rate = wins[index] / visits[index]
+                move = moves[index]
+                if amaf_visits[move]:
+                    win_rate += betas[index] * (amaf_wins[move] / amaf_visits[move] - win_rate)
+                ucb = win_rate + exploration * inv_sqrt_visits[index]
+                if ucb > best_ucb:
+                    best_ucb = ucb
+                    best = index
+            node = node.children[best]
+            path.append(node)
+            indices.append(best)
+        return path, indices
+
+    # Goes down the tree (using UCB) until it reaches a leaf node
     # Then, it stops being a leaf node and create leaf nodes of all of its children
-    def visit(self):
-        if self.leaf == False:
-            self.favorite_child().visit()
-        elif self.terminal == True:
-            wins, losses = self.rollout(self.env, self.sims) # Do a rollout from the terminal node
-            self.backpass(self.sims, wins, losses)        
+    def visit(self) -> None:
+        path, indices = self._descend()
+        node = path[-1]
+        if node.terminal:
+            wins, losses = self.rollout(node.env, node.sims) # Do a rollout from the terminal node
+            self.backpass(path, indices, node.sims, wins, losses)
         else: # It is a leaf node -> initialize all of its children
-            self.expand()
+            node.expand(path, indices)
     
     # Returns the maximum depth the tree reaches
-    def depth(self):
-        if len(self.children) == 0:
-            return 0
-        return 1 + max(child.depth() for child in self.children)
+    def depth(self) -> int:
+        depth = 0
+        level = self.children
+        while level: # Go down the tree one level at a time
+            depth += 1
+            level = list({id(child): child for node in level for child in node.children}.values()) # Shared nodes only once
+        return depth
 
     # Returns the total number of nodes in the tree (positions evaluated)
-    def size(self):
-        if len(self.children) == 0:
-            return 1
-        return sum(child.size() for child in self.children)
+    def size(self) -> int:
+        size = 0
+        seen = {id(self)} # Nodes can be shared between several parents, but are only counted once
+        queue = deque([self])
+        while queue:
+            node = queue.popleft()
+            if node.children:
+                for child in node.children:
+                    if id(child) not in seen:
+                        seen.add(id(child))
+                        queue.append(child)
+            else:
+                size += 1
+        return size
+
+# Adds the AMAF statistics counted by compiled rollouts (a list for each player) to a tree's amaf
+def _add_amaf(amaf: tuple, amaf_wins: list[list[float]], amaf_visits: list[list[float]]) -> None:
+    for totals, counts in zip(amaf, (amaf_wins, amaf_visits)):
+        for index in range(2):
+            for col, count in enumerate(counts[index]):
+                totals[index][col] += count
+
+# Counts one finished rollout in amaf: moves are the moves of the rollout, the first one made by player
+def _record_amaf(amaf: tuple, moves: list[int], player: int, winner: int) -> None:
+    amaf_wins, amaf_visits = amaf
+    for mover, columns in ((player, moves[0::2]), (-player, moves[1::2])):
+        index = mover == -1
+        for col in set(columns): # Each column only counts once per game
+            amaf_visits[index][col] += 1
+            if winner == mover:
+                amaf_wins[index][col] += 1
 
 # Uses a MCTS to calculate the best move from a given position, in a certain amount of time
 # sims is how many simulations are run from each leaf node 
 # Lower sims and lower exploration means higher depth, but lower accuracy
-def find_best_move(env: CF, thinking_time: float, sims: int, exploration: float) -> int:
+# If stop_event (a threading.Event) is given, setting it ends the search early
+def find_best_move(env: CF, thinking_time: float, sims: int, exploration: float, stop_event=None) -> int:
     node = Node(env=env, sims=sims, exploration=exploration)
     start = time.time()
-    while time.time() - start < thinking_time:
-        node.visit()
-    return max(node.children, key=lambda child: child.wins / child.visits).move # Which child has the highest win rate
+    while True:
+        node.visit() # Always visit at least once, so that the root has children to choose from
+        if time.time() - start >= thinking_time or stop_event is not None and stop_event.is_set():
+            break
+    for index, child in enumerate(node.children):
+        if child.terminal and child.env.winner == env.player: # A move that wins straight away is always best, even if
+            return node.child_moves[index]                    # other moves also win every rollout
+    best = max(range(len(node.children)), key=lambda index: node.child_wins[index] / node.child_visits[index])
+    return node.child_moves[best] # Which child has the highest win rate
@@ -0,0 +1,166 @@
+/*
+ * C versions of the Monte Carlo rollouts, loaded through ctypes by rollout_c.py when Numba isn't available
+ * Build with:
+ *     cc -O3 -march=native -shared -fPIC -o src/rollout.so src/rollout.c
+ * Boards use the same bitboards as ConnectFour (bit col*(nrows+1) + row, counting rows from the bottom),
+ * stored as uint64, so only boards with (nrows+1)*ncols <= 64 (and not too tall, see rollout_c.fits) are supported
+ */
+
+#include <stdint.h>
+
+/* xorshift64* random number generator; the state must never be 0 */
+static inline uint64_t next_random(uint64_t *state) {
+    uint64_t x = *state;
+    x ^= x >> 12;
+    x ^= x << 25;
+    x ^= x >> 27;
+    *state = x;
+    return x * 0x2545F4914F6CDD1DULL;
+}
+
+/* Random integer from 0 to n-1 */
+static inline int random_below(uint64_t *state, int n) {
+    return (int)(((next_random(state) >> 32) * (uint64_t)n) >> 32);
+}
+
+/* Returns whether a bitboard contains a four-in-a-row, by shifting it onto itself in each direction
+ * (1 is vertical, nrows+1 horizontal, nrows and nrows+2 the two diagonals) */
+static inline int has_win(uint64_t b, int nrows) {
+    int directions[4] = {1, nrows + 1, nrows, nrows + 2};
+    for (int i = 0; i < 4; i++) {
+        int d = directions[i];
+        uint64_t m = b & (b >> d);
+        if (m & (m >> (2 * d)))
+            return 1;
+    }
+    return 0;
+}
+
+/* Returns a bitboard of the cells that would complete a four-in-a-row for b, whether or not they are empty or playable */
+static inline uint64_t winning_cells(uint64_t b, int nrows) {
+    int h = nrows + 1;
+    uint64_t cells = (b << 1) & (b << 2) & (b << 3); /* Vertical: three pieces below */
+    int directions[3] = {h, h - 1, h + 1}; /* Horizontal and the two diagonals: three of the four cells around the gap */
+    for (int i = 0; i < 3; i++) {
+        int d = directions[i];
+        uint64_t pair = (b << d) & (b << 2 * d);
+        cells |= (pair & (b << 3 * d)) | (pair & (b >> d));
+        pair = (b >> d) & (b >> 2 * d);
+        cells |= (pair & (b << d)) | (pair & (b >> 3 * d));
+    }
+    return cells;
+}
+
+/* Plays a single game to the end and returns the winner (1, -1, or 0 for a draw). Each move wins immediately
+ * if it can, or else blocks the opponent from winning immediately, and is only random otherwise
+ * heights is changed, so must be a copy; played[i] gets a bitmask of the columns player i (0 for player 1) played in */
+static int play_out(uint64_t bb0, uint64_t bb1, uint8_t *heights, int player, int nrows, int ncols,
+                    uint64_t *state, uint64_t played[2]) {
+    int legal[64];
+    played[0] = 0;
+    played[1] = 0;
+    for (;;) {
+        int n = 0;
+        uint64_t playable = 0;
+        for (int col = 0; col < ncols; col++) /* Pack the legal moves into the front of the buffer */
+            if (heights[col] - col * (nrows + 1) < nrows) {
+                legal[n++] = col;
+                playable |= 1ULL << heights[col];
+            }
+        if (n == 0)
+            return 0; /* Board is full */
+        uint64_t cells = winning_cells(player == 1 ? bb0 : bb1, nrows) & playable;
+        int won = cells != 0;
+        if (!won)
+            cells = winning_cells(player == 1 ? bb1 : bb0, nrows) & playable; /* Block the opponent */
+        int col = legal[0];
+        if (cells) {
+            for (int j = 0; j < n; j++) /* Find the first column whose next cell is one of the cells */
+                if (cells >> heights[legal[j]] & 1) {
+                    col = legal[j];
+                    break;
+                }
+        } else {
+            col = legal[random_below(state, n)];
+        }
+        uint64_t bit = 1ULL << heights[col];
+        heights[col]++;
+        if (player == 1) {
+            bb0 ^= bit;
+            played[0] |= 1ULL << col;
+        } else {
+            bb1 ^= bit;
+            played[1] |= 1ULL << col;
+        }
+        if (won) /* Otherwise, the move can't have made a four-in-a-row */
+            return player;
+        player = -player;
+    }
+}
+
+/* Adds one finished game to the AMAF statistics (arrays of 2*ncols, player 1's columns first) */
+static void record_amaf(int winner, const uint64_t played[2], int ncols, double *amaf_wins, double *amaf_visits) {
+    for (int index = 0; index < 2; index++)
+        for (int col = 0; col < ncols; col++)
+            if (played[index] >> col & 1) {
+                amaf_visits[index * ncols + col] += 1;
+                if (winner == 1 - 2 * index)
+                    amaf_wins[index * ncols + col] += 1;
+            }
+}
+
+/* Plays sims random games from a position (which must not be over yet), adding the results to
+ * out_wp (positive wins), out_wn (negative wins), amaf_wins and amaf_visits */
+void rollout_many(uint64_t bb0, uint64_t bb1, const uint8_t *heights, int player, int nrows, int ncols, int sims, uint64_t seed,
+                  uint64_t *out_wp, uint64_t *out_wn, double *amaf_wins, double *amaf_visits) {
+    uint64_t state = seed ? seed : 1;
+    uint8_t h[64];
+    uint64_t played[2];
+    for (int i = 0; i < sims; i++) {
+        for (int col = 0; col < ncols; col++)
+            h[col] = heights[col];
+        int winner = play_out(bb0, bb1, h, player, nrows, ncols, &state, played);
+        if (winner == 1)
+            (*out_wp)++;
+        else if (winner == -1)
+            (*out_wn)++;
+        record_amaf(winner, played, ncols, amaf_wins, amaf_visits);
+    }
+}
+
+/* Rolls out every child of a position: plays each of the k moves (none of which may be into a full column),
+ * then sims random games after each one. out_wp and out_wn get the positive and negative wins for each move;
+ * the games are added to amaf_wins and amaf_visits (the moves themselves aren't counted) */
+void expand_rollouts(uint64_t bb0, uint64_t bb1, const uint8_t *heights, int player, int nrows, int ncols,
+                     const int *moves, int k, int sims, uint64_t seed,
+                     uint64_t *out_wp, uint64_t *out_wn, double *amaf_wins, double *amaf_visits) {
+    uint64_t state = seed ? seed : 1;
+    uint8_t h[64];
+    uint64_t played[2];
+    for (int child = 0; child < k; child++) {
+        int move = moves[child];
+        uint64_t bit = 1ULL << heights[move];
+        uint64_t b0 = player == 1 ? bb0 ^ bit : bb0;
+        uint64_t b1 = player == 1 ? bb1 : bb1 ^ bit;
+        out_wp[child] = 0;
+        out_wn[child] = 0;
+        if (has_win(player == 1 ? b0 : b1, nrows)) { /* The move itself wins */
+            if (player == 1)
+                out_wp[child] = sims;
+            else
+                out_wn[child] = sims;
+            continue;
+        }
+        for (int i = 0; i < sims; i++) {
+            for (int col = 0; col < ncols; col++)
+                h[col] = heights[col];
+            h[move]++;
+            int winner = play_out(b0, b1, h, -player, nrows, ncols, &state, played);
+            if (winner == 1)
+                out_wp[child]++;
+            else if (winner == -1)
+                out_wn[child]++;
+            record_amaf(winner, played, ncols, amaf_wins, amaf_visits);
+        }
+    }
+}
@@ -0,0 +1,55 @@
+"""
+Loads the C versions of the rollouts (rollout.c) through ctypes, for when Numba isn't installed
+The library has to be built first, with:
+cc -O3 -march=native -shared -fPIC -o src/rollout.so src/rollout.c
+Loading raises OSError if it hasn't been. Provides the same functions as rollout_numba
+"""
+
+import ctypes
+import os
+import random
+from connectfour import ConnectFour as CF
+
+_lib = ctypes.CDLL(os.path.join(os.path.dirname(os.path.abspath(__file__)), "rollout.so"))
+
+_u64 = ctypes.c_uint64
+_u64_p = ctypes.POINTER(ctypes.c_uint64)
+_u8_p = ctypes.POINTER(ctypes.c_uint8)
+_double_p = ctypes.POINTER(ctypes.c_double)
+_int = ctypes.c_int
+
+_lib.rollout_many.restype = None
+_lib.rollout_many.argtypes = [_u64, _u64, _u8_p, _int, _int, _int, _int, _u64, _u64_p, _u64_p, _double_p, _double_p]
+_lib.expand_rollouts.restype = None
+_lib.expand_rollouts.argtypes = [_u64, _u64, _u8_p, _int, _int, _int, ctypes.POINTER(_int), _int, _int, _u64, _u64_p, _u64_p, _double_p, _double_p]
+
+# Whether a board of this size fits in the uint64 bitboards used here (and no shift in winning_cells is by 64 or more)
+def fits(nrows: int, ncols: int) -> bool:
+    return (nrows + 1) * ncols <= 64 and 3 * (nrows + 2) < 64
+
+# Splits the AMAF statistics from C (2*ncols doubles, player 1's columns first) into one list per player
+def _split(amaf, ncols: int) -> list[list[float]]:
+    return [amaf[:ncols], amaf[ncols:]]
+
+# Plays sims random games from env (which must not be over yet)
+# Returns positive_wins, negative_wins, and the AMAF wins and visits as a list for each player
+def rollout_position(env: CF, sims: int) -> tuple:
+    positive_wins = _u64(0)
+    negative_wins = _u64(0)
+    amaf_wins = (ctypes.c_double * (2 * env.ncols))()
+    amaf_visits = (ctypes.c_double * (2 * env.ncols))()
+    _lib.rollout_many(env.bb[0], env.bb[1], (ctypes.c_uint8 * env.ncols)(*env.heights), env.player, env.nrows, env.ncols, sims,
+                      random.getrandbits(64), ctypes.byref(positive_wins), ctypes.byref(negative_wins), amaf_wins, amaf_visits)
+    return positive_wins.value, negative_wins.value, _split(amaf_wins[:], env.ncols), _split(amaf_visits[:], env.ncols)
+
+# Plays each move in moves from env, then sims random games after each one
+# Returns lists of the positive and negative wins for each move, and the AMAF wins and visits of all of the games
+def expand_position(env: CF, moves: list[int], sims: int) -> tuple:
+    positive_wins = (_u64 * len(moves))()
+    negative_wins = (_u64 * len(moves))()
+    amaf_wins = (ctypes.c_double * (2 * env.ncols))()
+    amaf_visits = (ctypes.c_double * (2 * env.ncols))()
+    _lib.expand_rollouts(env.bb[0], env.bb[1], (ctypes.c_uint8 * env.ncols)(*env.heights), env.player, env.nrows, env.ncols,
+                         (_int * len(moves))(*moves), len(moves), sims, random.getrandbits(64),
+                         positive_wins, negative_wins, amaf_wins, amaf_visits)
+    return positive_wins[:], negative_wins[:], _split(amaf_wins[:], env.ncols), _split(amaf_visits[:], env.ncols)
@@ -0,0 +1,174 @@
+"""
+Compiled versions of the Monte Carlo rollouts, using Numba
+The board is passed in as the two bitboards and the column heights of a ConnectFour object
+Bitboards are stored as int64, so only boards with (nrows+1)*ncols <= 63 (and not too tall, see fits()) are supported
+rollout_position and expand_position take a ConnectFour object; the same functions are provided by rollout_c
+"""
+
+import numpy as np
+from connectfour import ConnectFour as CF
+from numba import config, njit, prange
+
+# The graphics run the search in a background thread, and once the TBB threading layer has been used from
+# a thread other than the main one, it can stop the interpreter from exiting. So prefer the other layers
+config.THREADING_LAYER_PRIORITY = ["omp", "workqueue", "tbb"]
+
+# Whether a board of this size fits in the int64 bitboards used here (and no shift in winning_cells is by 64 or more)
+def fits(nrows: int, ncols: int) -> bool:
+    return (nrows + 1) * ncols <= 63 and 3 * (nrows + 2) < 64
+
+# Returns whether a bitboard contains a four-in-a-row, by shifting it onto itself in each direction
+# (1 is vertical, nrows+1 horizontal, nrows and nrows+2 the two diagonals)
+@njit(cache=True, inline="always")
+def has_win(bb: np.int64, nrows: int) -> bool:
+    for d in (1, nrows + 1, nrows, nrows + 2):
+        m = bb & (bb >> d)
+        if m & (m >> (2 * d)):
+            return True
+    return False
+
+# Same as ConnectFour._winning_cells: a bitboard of the cells that would complete a four-in-a-row for bb
+@njit(cache=True, inline="always")
+def winning_cells(bb: np.int64, nrows: int) -> np.int64:
+    h = nrows + 1
+    cells = (bb << 1) & (bb << 2) & (bb << 3)
+    for d in (h, h - 1, h + 1):
+        pair = (bb << d) & (bb << 2 * d)
+        cells |= pair & (bb << 3 * d) | pair & (bb >> d)
+        pair = (bb >> d) & (bb >> 2 * d)
+        cells |= pair & (bb << d) | pair & (bb >> 3 * d)
+    return cells
+
+# Plays a single game to the end. Each move wins immediately if it can, or else blocks the opponent from winning
+# immediately, and is only random otherwise. Returns the winner (1, -1, or 0 for a draw), and for each player
+# a bitmask of the columns they played in, for the AMAF statistics
+@njit(cache=True)
+def play_out(bb0: np.int64, bb1: np.int64, heights: np.ndarray, player: int, nrows: int, ncols: int):
+    h = heights.copy() # Each game needs its own heights, since the games may be running in parallel
+    legal = np.empty(ncols, np.int64)
+    played0 = np.int64(0)
+    played1 = np.int64(0)
+    while True:
+        n = 0
+        playable = np.int64(0)
+        for col in range(ncols): # Pack the legal moves into the front of the buffer
+            if h[col] - col * (nrows + 1) < nrows:
+                legal[n] = col
+                n += 1
+                playable |= np.int64(1) << np.int64(h[col])
+        if n == 0:
+            return 0, played0, played1 # Board is full
+        mine = bb0 if player == 1 else bb1
+        theirs = bb1 if player == 1 else bb0
+        cells = winning_cells(mine, nrows) & playable
+        won = cells != 0
+        if not won:
+            cells = winning_cells(theirs, nrows) & playable # Block the opponent
+        if cells:
+            col = legal[0]
+            for j in range(n): # Find the first column whose next cell is one of the cells
+                if cells >> np.int64(h[legal[j]]) & 1:
+                    col = legal[j]
+                    break
+        else:
+            col = legal[np.random.randint(n)]
+        bit = np.int64(1) << np.int64(h[col])
+        h[col] += 1
+        if player == 1:
+            bb0 ^= bit
+            played0 |= np.int64(1) << col
+        else:
+            bb1 ^= bit
+            played1 |= np.int64(1) << col
+        if won: # Otherwise, the move can't have made a four-in-a-row
+            return player, played0, played1
+        player = -player
+
+# Counts, for each player (index 0 for player 1, 1 for player -1) and column, how many of the games the player
+# played that column in, and how many of those they won. Done after the parallel loops, which can't share counters
+@njit(cache=True)
+def tally_amaf(winners: np.ndarray, played: np.ndarray, ncols: int):
+    amaf_wins = np.zeros((2, ncols))
+    amaf_visits = np.zeros((2, ncols))
+    for i in range(len(winners)):
+        for index in range(2):
+            for col in range(ncols):
+                if played[i, index] >> col & 1:
+                    amaf_visits[index, col] += 1
+                    if winners[i] == 1 - 2 * index:
+                        amaf_wins[index, col] += 1
+    return amaf_wins, amaf_visits
+
+# Plays sims random games from a position (which must not be over yet)
+# Returns positive_wins, negative_wins, and the AMAF wins and visits (see tally_amaf)
+# heights should be an np.int8 array
+@njit(parallel=True, cache=True, nogil=True)
+def rollout_many(bb0: np.int64, bb1: np.int64, heights: np.ndarray, player: int, nrows: int, ncols: int, sims: int):
+    winners = np.empty(sims, np.int8)
+    played = np.empty((sims, 2), np.int64)
+    for i in prange(sims):
+        winner, played0, played1 = play_out(bb0, bb1, heights, player, nrows, ncols)
+        winners[i] = winner
+        played[i, 0] = played0
+        played[i, 1] = played1
+    positive_wins = 0
+    negative_wins = 0
+    for i in range(sims):
+        if winners[i] == 1:
+            positive_wins += 1
+        elif winners[i] == -1:
+            negative_wins += 1
+    amaf_wins, amaf_visits = tally_amaf(winners, played, ncols)
+    return positive_wins, negative_wins, amaf_wins, amaf_visits
+
+# Rolls out every child of a position at once: plays each move in moves (none of which may be into a full column),
+# then sims random games after each one. Returns arrays of the positive and negative wins for each move, and the
+# AMAF wins and visits of all of the games together (the moves in moves themselves aren't counted)
+@njit(parallel=True, cache=True, nogil=True)
+def expand_rollouts(bb0: np.int64, bb1: np.int64, heights: np.ndarray, player: int, nrows: int, ncols: int, moves: np.ndarray, sims: int):
+    k = len(moves)
+    winners = np.empty(k * sims, np.int8)
+    played = np.zeros((k * sims, 2), np.int64)
+    for i in prange(k * sims): # All of the games are shared out between threads together
+        move = moves[i // sims]
+        h = heights.copy()
+        bit = np.int64(1) << np.int64(h[move])
+        h[move] += 1
+        if player == 1:
+            b0 = bb0 ^ bit
+            b1 = bb1
+            won = has_win(b0, nrows)
+        else:
+            b0 = bb0
+            b1 = bb1 ^ bit
+            won = has_win(b1, nrows)
+        if won: # The move itself wins
+            winners[i] = player
+        else:
+            winner, played0, played1 = play_out(b0, b1, h, -player, nrows, ncols)
+            winners[i] = winner
+            played[i, 0] = played0
+            played[i, 1] = played1
+    positive_wins = np.zeros(k, np.int64)
+    negative_wins = np.zeros(k, np.int64)
+    for i in range(k * sims):
+        if winners[i] == 1:
+            positive_wins[i // sims] += 1
+        elif winners[i] == -1:
+            negative_wins[i // sims] += 1
+    amaf_wins, amaf_visits = tally_amaf(winners, played, ncols)
+    return positive_wins, negative_wins, amaf_wins, amaf_visits
+
+# Plays sims random games from env (which must not be over yet)
+# Returns positive_wins, negative_wins, and the AMAF wins and visits as a list for each player
+def rollout_position(env: CF, sims: int) -> tuple:
+    positive_wins, negative_wins, amaf_wins, amaf_visits = rollout_many(np.int64(env.bb[0]), np.int64(env.bb[1]), np.array(env.heights, dtype=np.int8),
+                                                                        env.player, env.nrows, env.ncols, sims)
+    return positive_wins, negative_wins, amaf_wins.tolist(), amaf_visits.tolist()
+
+# Plays each move in moves from env, then sims random games after each one
+# Returns lists of the positive and negative wins for each move, and the AMAF wins and visits of all of the games
+def expand_position(env: CF, moves: list[int], sims: int) -> tuple:
+    positive_wins, negative_wins, amaf_wins, amaf_visits = expand_rollouts(np.int64(env.bb[0]), np.int64(env.bb[1]), np.array(env.heights, dtype=np.int8),
+                                                                           env.player, env.nrows, env.ncols, np.array(moves, dtype=np.int64), sims)
+    return positive_wins.tolist(), negative_wins.tolist(), amaf_wins.tolist(), amaf_visits.tolist()